@@ -1,31 +1,51 @@
+import heapq
+import io
+import mmap
+import os
+import struct
+
+BITMAP = struct.Struct('<Q')  # Block 0 bitmap packed as one little-endian 64-bit word
+DESCRIPTOR = struct.Struct('<4i')  # length, block1, block2, block3: 16 bytes, 32 per block
+DIRENT = struct.Struct('<4sI')  # NUL-padded filename, descriptor index: 8 bytes, 64 in block 7
+DATA_BLOCKS_MASK = ((1 << 64) - 1) & ~0xFF  # Blocks 8-63
+ZEROS = bytes(512)  # Used to clear a block buffer in place
+
 class EmulatedDisk:
     def __init__(self):
-        self.disk = [[0] * 512 for _ in range(64)]  # 2D array of 64 blocks of 512 bytes each
-        self.bitmap = self.disk[0] = [0] * 64  # 64 bits each representing 1 block
+        self.disk = bytearray(64 * 512)  # 64 blocks of 512 bytes each, stored contiguously
+        self.bitmap = 0  # 64 bits each representing 1 block, mirrored to block 0
 
     def __getitem__(self, i):
-        return self.disk[i]
+        return self.read_block(i)
     
     def __setitem__(self, i, e):
-        self.disk[i] = e   
+        self.write_block(i, e)
 
-    def read_block(self, block_index: int):
-        if block_index < 0 or block_index > 63:
+    def read_block(self, block_index: int) -> memoryview:
+        if not 0 <= block_index < 64:
             raise IndexError("Block index out of range.")
 
-        return self.disk[block_index]
+        return memoryview(self.disk)[block_index * 512:(block_index + 1) * 512]
 
-    def write_block(self, block_index: int, data: list):
-        if block_index < 0 or block_index > 63:
+    def write_block(self, block_index: int, data: bytes):
+        if not 0 <= block_index < 64:
             raise IndexError("Block index out of range.")
         
         if len(data) != 512:
             raise ValueError("Input array data must be 512 bytes.")
 
-        self.disk[block_index] = list(data)
+        self.disk[block_index * 512:(block_index + 1) * 512] = data
 
     def block_free(self, block_index: int) -> bool:
-        return self.bitmap[block_index] == 0
+        return not (self.bitmap >> block_index) & 1
+
+    def mark_block_used(self, block_index: int):
+        self.bitmap |= 1 << block_index
+        BITMAP.pack_into(self.disk, 0, self.bitmap)
+
+    def mark_block_free(self, block_index: int):
+        self.bitmap &= ~(1 << block_index)
+        BITMAP.pack_into(self.disk, 0, self.bitmap)
 
 class FileSystem:
     def __init__(self):
@@ -33,298 +53,288 @@ class FileSystem:
 
     def init(self):
         self.disk = EmulatedDisk()
-        self.bitmap = self.disk.bitmap
 
         # Bitmap: mark blocks 0 to 7 as occupied (1), rest are free (0)
         for i in range(8):
-            self.bitmap[i] = 1
+            self.disk.mark_block_used(i)
 
-        # File descriptors: each block 1-6 holds 32 each
-        for i in range(1, 7):
-            self.disk[i] = [[-1, 0, 0, 0] for _ in range(32)]
-        
-        self.descriptors = self.disk[1:7]
+        # File descriptors: each block 1-6 holds 32 each, all initially free (length -1)
+        self.disk.disk[512:7 * 512] = DESCRIPTOR.pack(-1, 0, 0, 0) * 192
 
         self.I = [0] * 512
         self.O = [0] * 512
         self.M = [0] * 512
 
-        self.oft = [{'buffer': [0] * 512, 'current_pos': -1, 'file_size': 0, 'descriptor_index': 0} for _ in range(4)]
+        # Open file table, stored as parallel lists indexed by OFT entry
+        self.oft_buffer = [bytearray(512) for _ in range(4)]
+        self.oft_pos = [-1] * 4  # -1 marks a free entry
+        self.oft_size = [0] * 4
+        self.oft_desc_index = [0] * 4
+        self.oft_desc = [None] * 4  # Working copy of the descriptor, written back by write()
+        self.oft_free_mask = 0b1110  # Bit i set means entry i is free; entry 0 is reserved for the directory
+        self.oft_by_desc = {0: 0}  # desc_index -> OFT entry of every open file
+
+        self.write_descriptor(0, 0, 7, 0, 0)  # Directory: file_length=0, block1=7
 
-        self.directory = self.disk[7] = [["", 0] for _ in range(64)]
+        # Directory entries live in block 7; index them by name and collect free entries
+        self.name_index = {}  # filename -> (dir_index, desc_index)
+        self.free_dir_slots = []  # Min-heap of free directory entries
+        for i, (name, desc_index) in enumerate(DIRENT.iter_unpack(self.disk.read_block(7))):
+            if name[0]:
+                self.name_index[name.rstrip(b'\0').decode()] = (i, desc_index)
+            else:
+                self.free_dir_slots.append(i)  # Appended in ascending order, so already a heap
 
-        self.descriptors[0][0] = [0, 7, 0, 0]  # Directory: file_length=0, block1=7
+        # Free descriptor mask: bit i set means descriptor i is free
+        self.free_descriptors = 0
+        for i, descriptor in enumerate(DESCRIPTOR.iter_unpack(memoryview(self.disk.disk)[512:7 * 512])):
+            if descriptor[0] == -1:
+                self.free_descriptors |= 1 << i
 
         # Open directory in oft[0]
-        self.oft[0]["buffer"] = self.disk.read_block(7)
-        self.oft[0]["current_pos"] = 0
-        self.oft[0]["file_size"] = 0
-        self.oft[0]["descriptor_index"] = 0
+        self.oft_buffer[0][:] = self.disk.read_block(7)
+        self.oft_pos[0] = 0
+        self.oft_size[0] = 0
+        self.oft_desc_index[0] = 0
+        self.oft_desc[0] = list(self.read_descriptor(0))
 
     def create(self, filename: str) -> int:
-        if len(filename) > 3:
+        name = filename.encode()
+        if len(name) > 3:
             return -1  # Error: filename too long
+
+        if not name or b'\0' in name:
+            return -1  # Error: NUL marks free entries and pads names on disk
         
         # Check if file already exists
-        for entry in self.directory:
-            if entry[0] == filename:
-                return -1  # Error: file already exists
+        if filename in self.name_index:
+            return -1  # Error: file already exists
         
-        # Search directory for free entry
-        dir_entry = None
-        dir_index = -1
-        for i, entry in enumerate(self.directory):
-            if entry[0] == "":  # Free entry
-                dir_entry = entry
-                dir_index = i
-                break
-        
-        if dir_entry is None:
+        # Lowest free directory entry
+        if not self.free_dir_slots:
             return -1  # Error: directory full
+
+        dir_index = self.free_dir_slots[0]
         
         # Find free descriptor
-        desc_index = -1
-        for i in range(192):  # 6 blocks * 32 descriptors
-            block = i // 32
-            offset = i % 32
-            if self.descriptors[block][offset][0] == -1:  # Free descriptor
-                desc_index = i
-                break
-        
-        if desc_index == -1:
+        if self.free_descriptors == 0:
             return -1  # Error: no free descriptors
+
+        desc_index = (self.free_descriptors & -self.free_descriptors).bit_length() - 1  # Lowest set bit
         
         # Find free block
-        block_num = -1
-        for i in range(8, 64):
-            if self.bitmap[i] == 0:
-                block_num = i
-                self.bitmap[i] = 1  # Mark as used
-                break
-        
+        block_num = self.find_free_block()
         if block_num == -1:
             return -1  # Error: no free blocks
+
+        self.disk.mark_block_used(block_num)
         
         # Initialize descriptor
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        self.descriptors[block_idx][desc_offset] = [0, block_num, 0, 0]  # length=0, first block allocated
+        self.write_descriptor(desc_index, 0, block_num, 0, 0)  # length=0, first block allocated
+        self.free_descriptors &= ~(1 << desc_index)
         
         # Update directory
-        self.directory[dir_index] = [filename, desc_index]
-        
-        # Write updated directory to disk
-        self.disk[7] = self.directory
+        heapq.heappop(self.free_dir_slots)
+        self.write_directory_entry(dir_index, name, desc_index)
+        self.name_index[filename] = (dir_index, desc_index)
         
         return 0  # Success
 
     def destroy(self, filename: str) -> int:
         # Find file in directory
-        dir_entry = None
-        dir_index = -1
-        for i, entry in enumerate(self.directory):
-            if entry[0] == filename:
-                dir_entry = entry
-                dir_index = i
-                break
-        
+        dir_entry = self.name_index.get(filename)
         if dir_entry is None:
             return -1  # Error: file not found
         
-        desc_index = dir_entry[1]
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        descriptor = self.descriptors[block_idx][desc_offset]
+        dir_index, desc_index = dir_entry
+
+        # Release the file's OFT entry so it can't write to the freed descriptor
+        if desc_index in self.oft_by_desc:
+            self.close(self.oft_by_desc[desc_index])
+
+        descriptor = self.read_descriptor(desc_index)
         
         # Free all blocks used by file
         for block_num in descriptor[1:4]:
             if block_num != 0:
-                self.bitmap[block_num] = 0
+                self.disk.mark_block_free(block_num)
         
         # Mark descriptor as free
-        self.descriptors[block_idx][desc_offset] = [-1, 0, 0, 0]
+        self.write_descriptor(desc_index, -1, 0, 0, 0)
+        self.free_descriptors |= 1 << desc_index
         
         # Mark directory entry as free
-        self.directory[dir_index] = ["", 0]
-        
-        # Write updated directory to disk
-        self.disk[7] = self.directory
+        self.write_directory_entry(dir_index, b'', 0)
+        del self.name_index[filename]
+        heapq.heappush(self.free_dir_slots, dir_index)
         
         return 0  # Success
 
     def open(self, filename: str) -> int:
         # Find file in directory
-        desc_index = -1
-        for entry in self.directory:
-            if entry[0] == filename:
-                desc_index = entry[1]
-                break
-        
-        if desc_index == -1:
+        dir_entry = self.name_index.get(filename)
+        if dir_entry is None:
             return -1  # Error: file not found
+
+        desc_index = dir_entry[1]
         
         # Check if file is already open
-        for i in range(4):  # Check all OFT entries
-            if self.oft[i]["descriptor_index"] == desc_index and self.oft[i]["current_pos"] != -1:
-                return -1  # Error: file already open
+        if desc_index in self.oft_by_desc:
+            return -1  # Error: file already open
         
         # Find free OFT entry
-        oft_index = -1
-        for i in range(1, 4):  # Skip index 0 (reserved for directory)
-            if self.oft[i]["current_pos"] == -1:
-                oft_index = i
-                break
-        
-        if oft_index == -1:
+        if self.oft_free_mask == 0:
             return -1  # Error: no free OFT entries
+
+        oft_index = (self.oft_free_mask & -self.oft_free_mask).bit_length() - 1  # Lowest set bit
+        self.oft_free_mask &= ~(1 << oft_index)
+        self.oft_by_desc[desc_index] = oft_index
         
         # Get descriptor
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        descriptor = self.descriptors[block_idx][desc_offset]
+        descriptor = self.read_descriptor(desc_index)
         
         # Initialize OFT entry
-        self.oft[oft_index] = {
-            "buffer": self.disk.read_block(descriptor[1]),  # Read first block
-            "current_pos": 0,
-            "file_size": descriptor[0],
-            "descriptor_index": desc_index
-        }
+        self.oft_buffer[oft_index][:] = self.disk.read_block(descriptor[1])  # Read first block
+        self.oft_pos[oft_index] = 0
+        self.oft_size[oft_index] = descriptor[0]
+        self.oft_desc_index[oft_index] = desc_index
+        self.oft_desc[oft_index] = list(descriptor)
         
         return oft_index
 
     def close(self, index: int) -> int:
-        if index < 0 or index > 3 or self.oft[index]["current_pos"] == -1:
+        if index < 0 or index > 3 or self.oft_pos[index] == -1:
             return -1  # Error: invalid index or already closed
         
-        # Get descriptor
-        desc_index = self.oft[index]["descriptor_index"]
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        descriptor = self.descriptors[block_idx][desc_offset]
-        
-        # Write final buffer to disk
-        current_block_index = self.oft[index]["current_pos"] // 512
-        if current_block_index == 0:
-            current_block = descriptor[1]
-        else:
-            current_block = descriptor[1 + current_block_index]
-        
-        if current_block != 0:
-            self.disk[current_block] = self.oft[index]["buffer"]
+        # No final flush needed: write() already wrote every modified block back to disk
         
-        # Mark OFT entry as free
-        self.oft[index] = {"buffer": [0] * 512, "current_pos": -1, "file_size": 0, "descriptor_index": 0}
+        # Mark OFT entry as free; entry 0 stays reserved for the directory
+        if index != 0:
+            self.oft_free_mask |= 1 << index
+        del self.oft_by_desc[self.oft_desc_index[index]]
+        self.oft_buffer[index][:] = ZEROS
+        self.oft_pos[index] = -1
+        self.oft_size[index] = 0
+        self.oft_desc_index[index] = 0
+        self.oft_desc[index] = None
         
         return 0
 
-    def read(self, index: int, mem_area: list, count: int) -> int:
-        if index < 0 or index > 3 or self.oft[index]["current_pos"] == -1:
+    def read(self, index: int, mem_area: bytearray, count: int) -> int:
+        if index < 0 or index > 3 or self.oft_pos[index] == -1:
             return -1  # Error: invalid index or file not open
         
-        # Get descriptor
-        desc_index = self.oft[index]["descriptor_index"]
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        descriptor = self.descriptors[block_idx][desc_offset]
-        
+        # Hoist OFT fields into locals; current_pos is stored back on exit
+        descriptor = self.oft_desc[index]
+        buffer = self.oft_buffer[index]
+        buffer_view = memoryview(buffer)
+        disk = self.disk
+        pos = self.oft_pos[index]
+        size = descriptor[0]
+        
+        # If we need to load a different block
+        current_block_index = pos // 512
+        if current_block_index > 0 and count > 0 and pos < size:
+            block_num = descriptor[1 + current_block_index]
+            if block_num != 0:
+                buffer[:] = disk.read_block(block_num)
+
         bytes_read = 0
         while bytes_read < count:
             # Check if we've reached EOF
-            if self.oft[index]["current_pos"] >= descriptor[0]:
+            if pos >= size:
                 break
-            
-            # Get current block number and position
-            current_block_index = self.oft[index]["current_pos"] // 512
-            buffer_pos = self.oft[index]["current_pos"] % 512
-            
-            # If we need to load a different block
-            if current_block_index > 0 and bytes_read == 0:
-                block_num = descriptor[1 + current_block_index]
-                if block_num != 0:
-                    self.oft[index]["buffer"] = self.disk.read_block(block_num)
-            
+
+            # Copy up to the end of the request, the block, or the file in one slice
+            buffer_pos = pos % 512
+            n = min(count - bytes_read, 512 - buffer_pos, size - pos)
+
             # Read from buffer
-            mem_area[bytes_read] = self.oft[index]["buffer"][buffer_pos]
-            bytes_read += 1
-            self.oft[index]["current_pos"] += 1
-            
+            mem_area[bytes_read:bytes_read + n] = buffer_view[buffer_pos:buffer_pos + n]
+            bytes_read += n
+            pos += n
+
             # If we've reached end of current block, load next block
-            if self.oft[index]["current_pos"] % 512 == 0 and bytes_read < count:
-                next_block_index = self.oft[index]["current_pos"] // 512
+            if pos % 512 == 0 and bytes_read < count:
+                next_block_index = pos // 512
                 if next_block_index < 3:  # Max 3 blocks per file
                     block_num = descriptor[1 + next_block_index]
                     if block_num != 0:
-                        self.oft[index]["buffer"] = self.disk.read_block(block_num)
+                        buffer[:] = disk.read_block(block_num)
                     else:
                         break
                 else:
                     break
         
+        self.oft_pos[index] = pos
         return bytes_read
 
-    def write(self, index: int, mem_area: list, count: int) -> int:
-        if index < 0 or index > 3 or self.oft[index]["current_pos"] == -1:
+    def write(self, index: int, mem_area: bytearray, count: int) -> int:
+        if index < 0 or index > 3 or self.oft_pos[index] == -1:
             return -1  # Error: invalid index or file not open
-        
-        # Get descriptor
-        desc_index = self.oft[index]["descriptor_index"]
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        descriptor = self.descriptors[block_idx][desc_offset]
+
+        if count > len(mem_area):
+            return -1  # Error: not enough bytes in memory area
+
+        # Hoist OFT fields into locals; current_pos is stored back on exit
+        descriptor = self.oft_desc[index]
+        buffer = self.oft_buffer[index]
+        disk = self.disk
+        pos = self.oft_pos[index]
+        mem_view = memoryview(mem_area)  # Slices of a view don't copy
         
         bytes_written = 0
         while bytes_written < count:
             # Get current block number and position within block
-            current_block_index = self.oft[index]["current_pos"] // 512
+            current_block_index = pos // 512
             
             # Check if we've exceeded max file size (3 blocks)
             if current_block_index >= 3:
                 # Return bytes written so far, even if less than requested
-                return bytes_written
+                break
             
-            buffer_pos = self.oft[index]["current_pos"] % 512
+            buffer_pos = pos % 512
             
             # If we need a new block
             if buffer_pos == 0 and current_block_index > 0:
                 # Find a free block
                 new_block = self.find_free_block()
                 if new_block == -1:
-                    return bytes_written  # Return bytes written so far if no more blocks available
+                    break  # Return bytes written so far if no more blocks available
                 
                 # Update descriptor with new block
                 descriptor[1 + current_block_index] = new_block
                 # Mark block as used
-                self.bitmap[new_block] = 1
+                disk.mark_block_used(new_block)
                 # Load new block into buffer
-                self.oft[index]["buffer"] = [0] * 512
-            
-            # Write to buffer
-            self.oft[index]["buffer"][buffer_pos] = mem_area[bytes_written]
-            bytes_written += 1
-            self.oft[index]["current_pos"] += 1
-            
-            # If buffer is full or this is the last byte, write back to disk
-            if buffer_pos == 511 or bytes_written == count:
-                block_num = descriptor[1 + current_block_index]
-                if block_num != 0:
-                    self.disk.write_block(block_num, self.oft[index]["buffer"])
+                buffer[:] = ZEROS
             
+            # Write up to the end of the request or the block in one slice
+            n = min(count - bytes_written, 512 - buffer_pos)
+            buffer[buffer_pos:buffer_pos + n] = mem_view[bytes_written:bytes_written + n]
+            bytes_written += n
+            pos += n
+
+            # Buffer is either full or holds the last byte, write back to disk
+            block_num = descriptor[1 + current_block_index]
+            if block_num != 0:
+                disk.write_block(block_num, buffer)
+
             # Update file size in descriptor if we've written beyond current size
-            if self.oft[index]["current_pos"] > descriptor[0]:
-                descriptor[0] = self.oft[index]["current_pos"]
+            if pos > descriptor[0]:
+                descriptor[0] = pos
+
+        # Persist position, new length and block pointers
+        self.oft_pos[index] = pos
+        self.write_descriptor(self.oft_desc_index[index], *descriptor)
         
         return bytes_written
 
     def seek(self, index: int, pos: int) -> int:
-        if index < 0 or index > 3 or self.oft[index]["current_pos"] == -1:
+        if index < 0 or index > 3 or self.oft_pos[index] == -1:
             return -1  # Error: invalid index or file not open
         
-        # Get descriptor
-        desc_index = self.oft[index]["descriptor_index"]
-        block_idx = desc_index // 32
-        desc_offset = desc_index % 32
-        descriptor = self.descriptors[block_idx][desc_offset]
+        descriptor = self.oft_desc[index]
         
         if pos < 0 or pos > descriptor[0]:
             return -1  # Error: invalid position
@@ -336,160 +346,197 @@ class FileSystem:
         if new_block_index < 3:  # Max 3 blocks per file
             block_num = descriptor[1 + new_block_index]
             if block_num != 0:
-                self.oft[index]["buffer"] = self.disk.read_block(block_num)
+                self.oft_buffer[index][:] = self.disk.read_block(block_num)
             else:
                 return -1  # Error: block not allocated
         else:
             return -1  # Error: position beyond file limit
         
-        self.oft[index]["current_pos"] = pos
+        self.oft_pos[index] = pos
         return pos
 
     def list_directory(self) -> list:
         dir_contents = []
-        for entry in self.directory:
-            if entry[0] != "":  # If entry is not free
-                desc_index = entry[1]
-                block_idx = desc_index // 32
-                desc_offset = desc_index % 32
-                descriptor = self.descriptors[block_idx][desc_offset]
-                dir_contents.append((entry[0], descriptor[0]))  # (filename, length)
+        for name, desc_index in DIRENT.iter_unpack(self.disk.read_block(7)):
+            if name[0]:  # If entry is not free
+                descriptor = self.read_descriptor(desc_index)
+                dir_contents.append((name.rstrip(b'\0').decode(), descriptor[0]))  # (filename, length)
         return dir_contents
 
+    def read_descriptor(self, desc_index: int) -> tuple:
+        # Descriptors are packed back to back starting at block 1
+        return DESCRIPTOR.unpack_from(self.disk.disk, 512 + desc_index * DESCRIPTOR.size)
+
+    def write_descriptor(self, desc_index: int, length: int, block1: int, block2: int, block3: int):
+        DESCRIPTOR.pack_into(self.disk.disk, 512 + desc_index * DESCRIPTOR.size, length, block1, block2, block3)
+
+    def write_directory_entry(self, dir_index: int, name: bytes, desc_index: int):
+        # Only the 8 byte entry is rewritten, block 7 is always up to date
+        DIRENT.pack_into(self.disk.disk, 7 * 512 + dir_index * DIRENT.size, name, desc_index)
+
     def find_free_block(self) -> int:
-        for i in range(8, 64):
-            if self.bitmap[i] == 0:
-                return i
-        return -1
+        free = ~self.disk.bitmap & DATA_BLOCKS_MASK
+        if free == 0:
+            return -1
+        return (free & -free).bit_length() - 1  # Lowest set bit
 
 def shell(fs=None, input_file=None, output_file=None):
     if fs is None:
         fs = FileSystem()
     
     # Memory array M for read/write operations
-    M = [0] * 1024  # 1KB of memory
+    M = bytearray(1024)  # 1KB of memory
     
     # Setup output handling
     output_stream = None
+    output_lines = []  # Pending output, written to output_stream in one call on exit
     if output_file:
         try:
-            output_stream = open(output_file, 'w')
+            output_stream = open(output_file, 'w', buffering=65536)
         except IOError:
             print(f"Error: Could not open output file {output_file}")
             return
     
     def write_output(message):
         if output_stream:
-            output_stream.write(message + '\n')
-            output_stream.flush()
+            output_lines.append(message + '\n')
         else:
             print(message)
+
+    def check_memory_range(mem_pos, count):
+        # Slice assignment would silently resize M, so reject out of range accesses up front
+        if mem_pos < 0 or count < 0 or mem_pos + count > len(M):
+            raise IndexError("Memory position out of range.")
     
+    def cmd_cr(tokens):
+        name = tokens[1]
+        if fs.create(name) == 0:
+            write_output(f"{name} created")
+        else:
+            write_output("error")
+
+    def cmd_de(tokens):
+        name = tokens[1]
+        if fs.destroy(name) == 0:
+            write_output(f"{name} destroyed")
+        else:
+            write_output("error")
+
+    def cmd_op(tokens):
+        name = tokens[1]
+        index = fs.open(name)
+        if index >= 0:
+            write_output(f"{name} opened {index}")
+        else:
+            write_output("error")
+
+    def cmd_cl(tokens):
+        index = int(tokens[1])
+        if fs.close(index) == 0:
+            write_output(f"{index} closed")
+        else:
+            write_output("error")
+
+    def cmd_rd(tokens):
+        index = int(tokens[1])
+        mem_pos = int(tokens[2])
+        count = int(tokens[3])
+        read_buffer = bytearray(max(count, 0))
+        bytes_read = fs.read(index, read_buffer, count)
+        if bytes_read >= 0:
+            # Copy to memory M
+            check_memory_range(mem_pos, bytes_read)
+            M[mem_pos:mem_pos + bytes_read] = memoryview(read_buffer)[:bytes_read]
+            write_output(f"{bytes_read} bytes read from {index}")
+        else:
+            write_output("error")
+
+    def cmd_wr(tokens):
+        index = int(tokens[1])
+        mem_pos = int(tokens[2])
+        count = int(tokens[3])
+        check_memory_range(mem_pos, count)
+        # View into memory M, no copy
+        write_buffer = memoryview(M)[mem_pos:mem_pos + count]
+        bytes_written = fs.write(index, write_buffer, count)
+        if bytes_written > 0:
+            write_output(f"{bytes_written} bytes written to {index}")
+        else:
+            write_output("error")
+
+    def cmd_sk(tokens):
+        index = int(tokens[1])
+        pos = int(tokens[2])
+        if fs.seek(index, pos) >= 0:
+            write_output(f"position is {pos}")
+        else:
+            write_output("error")
+
+    def cmd_dr(tokens):
+        contents = fs.list_directory()
+        if contents:
+            output = " ".join(f"{name} {length}" for name, length in contents)
+            write_output(output)
+        else:
+            write_output("")  # Empty directory
+
+    def cmd_in(tokens):
+        fs.init()
+        M[:] = bytes(1024)  # Reset cache
+        write_output("system initialized")
+
+    def cmd_rm(tokens):
+        mem_pos = int(tokens[1])
+        count = max(int(tokens[2]), 0)  # A negative count prints nothing
+        check_memory_range(mem_pos, count)
+
+        # Only output if the memory location has been written to
+        # A range that cuts a multi-byte character prints U+FFFD in its place
+        output = M[mem_pos:mem_pos + count].translate(None, b'\0').decode(errors='replace')
+
+        write_output(output)
+
+    def cmd_wm(tokens):
+        mem_pos = int(tokens[1])
+        # Join all remaining tokens as the string to write
+        input_str = " ".join(tokens[2:])
+        # Copy string to memory M as UTF-8, the same encoding as scripts and filenames
+        data = input_str.encode()
+        check_memory_range(mem_pos, len(data))
+        M[mem_pos:mem_pos + len(data)] = data
+        write_output(f"{len(data)} bytes written to M")
+
+    # Command -> (handler, token count); a negative count means at least that many tokens
+    commands = {
+        'cr': (cmd_cr, 2),
+        'de': (cmd_de, 2),
+        'op': (cmd_op, 2),
+        'cl': (cmd_cl, 2),
+        'rd': (cmd_rd, 4),
+        'wr': (cmd_wr, 4),
+        'sk': (cmd_sk, 3),
+        'dr': (cmd_dr, 1),
+        'in': (cmd_in, 1),
+        'rm': (cmd_rm, 3),
+        'wm': (cmd_wm, -3),
+    }
+
     def process_command(line):
-        nonlocal M
         try:
             tokens = line.strip().split()
             if not tokens:
                 return
-            
-            cmd = tokens[0].lower()
-            
-            if cmd == 'cr' and len(tokens) == 2:
-                name = tokens[1]
-                if fs.create(name) == 0:
-                    write_output(f"{name} created")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'de' and len(tokens) == 2:
-                name = tokens[1]
-                if fs.destroy(name) == 0:
-                    write_output(f"{name} destroyed")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'op' and len(tokens) == 2:
-                name = tokens[1]
-                index = fs.open(name)
-                if index >= 0:
-                    write_output(f"{name} opened {index}")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'cl' and len(tokens) == 2:
-                index = int(tokens[1])
-                if fs.close(index) == 0:
-                    write_output(f"{index} closed")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'rd' and len(tokens) == 4:
-                index = int(tokens[1])
-                mem_pos = int(tokens[2])
-                count = int(tokens[3])
-                read_buffer = [0] * count
-                bytes_read = fs.read(index, read_buffer, count)
-                if bytes_read >= 0:
-                    # Copy to memory M
-                    for i in range(bytes_read):
-                        M[mem_pos + i] = read_buffer[i]
-                    write_output(f"{bytes_read} bytes read from {index}")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'wr' and len(tokens) == 4:
-                index = int(tokens[1])
-                mem_pos = int(tokens[2])
-                count = int(tokens[3])
-                # Copy from memory M
-                write_buffer = M[mem_pos:mem_pos + count]
-                bytes_written = fs.write(index, write_buffer, count)
-                if bytes_written > 0:
-                    write_output(f"{bytes_written} bytes written to {index}")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'sk' and len(tokens) == 3:
-                index = int(tokens[1])
-                pos = int(tokens[2])
-                if fs.seek(index, pos) >= 0:
-                    write_output(f"position is {pos}")
-                else:
-                    write_output("error")
-            
-            elif cmd == 'dr' and len(tokens) == 1:
-                contents = fs.list_directory()
-                if contents:
-                    output = " ".join(f"{name} {length}" for name, length in contents)
-                    write_output(output)
-                else:
-                    write_output("")  # Empty directory
-            
-            elif cmd == 'in' and len(tokens) == 1:
-                fs.init()
-                M[:] = [0] * 1024  # Reset cache
-                write_output("system initialized")
-            
-            elif cmd == 'rm' and len(tokens) == 3:
-                mem_pos = int(tokens[1])
-                count = int(tokens[2])
 
-                # Only output if the memory location has been written to                
-                output = "".join(c for c in (chr(M[mem_pos + i]) for i in range(count)) if c != '\0')
-                
-                write_output(output)
-            
-            elif cmd == 'wm' and len(tokens) >= 3:
-                mem_pos = int(tokens[1])
-                # Join all remaining tokens as the string to write
-                input_str = " ".join(tokens[2:])
-                # Copy string to memory M
-                for i, char in enumerate(input_str):
-                    M[mem_pos + i] = ord(char)
-                write_output(f"{len(input_str)} bytes written to M")
-            
+            handler, token_count = commands.get(tokens[0].lower(), (None, 0))
+            if token_count < 0:
+                valid = len(tokens) >= -token_count
             else:
+                valid = len(tokens) == token_count
+
+            if handler is None or not valid:
                 write_output("error")
+            else:
+                handler(tokens)
                 
         except (IndexError, ValueError) as e:
             write_output("error")
@@ -497,9 +544,13 @@ def shell(fs=None, input_file=None, output_file=None):
     try:
         if input_file:
             try:
-                with open(input_file, 'r') as f:
-                    for line in f:
-                        process_command(line)
+                with open(input_file, 'rb') as f:
+                    # mmap can't map an empty file, and there is nothing to run anyway
+                    if os.fstat(f.fileno()).st_size > 0:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            # Universal newlines (\n, \r\n, \r), same as reading the file in text mode
+                            for line in io.StringIO(mm[:].decode(), newline=None):
+                                process_command(line)
             except FileNotFoundError:
                 write_output(f"Error: Could not open input file {input_file}")
         else:
@@ -511,6 +562,8 @@ def shell(fs=None, input_file=None, output_file=None):
                     break
     finally:
         if output_stream:
+            output_stream.writelines(output_lines)
+            output_stream.flush()
             output_stream.close()
 
 if __name__ == "__main__":